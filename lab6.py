@@ -1,111 +1,349 @@
 import streamlit as st
 import pandas as pd
 import sqlite3
-from datetime import datetime
+import threading
+from contextlib import contextmanager
 import altair as alt
 
 # ---------------- Database helpers ----------------
 DB_PATH = "library.db"
 
+# SQL templates are fixed at import time so the connection's statement cache
+# reuses the prepared plans instead of re-parsing strings built per call.
+SQL_ADD_BOOK = "INSERT INTO books (title, author, genre, year, total_copies, available, added_on) VALUES (?, ?, ?, ?, ?, ?, strftime('%s','now'))"
+SQL_LIST_BOOKS = "SELECT * FROM books ORDER BY id LIMIT ? OFFSET ?"
+SQL_SEARCH_FTS = ("SELECT b.* FROM books b JOIN books_fts f ON f.rowid = b.id "
+                  "WHERE books_fts MATCH ? ORDER BY bm25(books_fts)")
+SQL_SEARCH_LIKE = "SELECT * FROM books WHERE title LIKE ? OR author LIKE ? OR genre LIKE ? ORDER BY title"
+SQL_BOOK_CHOICES = "SELECT id, title, available FROM books ORDER BY title"
+SQL_BOOK_CHOICES_FTS = ("SELECT b.id, b.title, b.available FROM books b JOIN books_fts f ON f.rowid = b.id "
+                        "WHERE books_fts MATCH ? ORDER BY bm25(books_fts)")
+SQL_STATS = "SELECT COUNT(*), COALESCE(SUM(total_copies), 0), COALESCE(SUM(available), 0) FROM books"
+SQL_GENRE_COUNTS = "SELECT genre, SUM(total_copies) AS total_copies FROM books GROUP BY genre"
+SQL_BORROW = "UPDATE books SET available = available - 1 WHERE id = ? AND available > 0 RETURNING available"
+SQL_RETURN = "UPDATE books SET available = available + 1 WHERE id = ? AND available < total_copies RETURNING available"
+SQL_LOG_TX = ("INSERT INTO transactions (book_id, title, action, user, timestamp) "
+              "VALUES (?, (SELECT title FROM books WHERE id = ?), ?, ?, strftime('%s','now'))")
+SQL_TRANSACTIONS = ("SELECT id, book_id, title, action, user, timestamp "
+                    "FROM transactions ORDER BY timestamp DESC, id DESC LIMIT ?")
+SQL_TRANSACTIONS_PAGE = ("SELECT id, book_id, title, action, user, timestamp "
+                         "FROM transactions WHERE timestamp < ? OR (timestamp = ? AND id < ?) "
+                         "ORDER BY timestamp DESC, id DESC LIMIT ?")
+SQL_CREATE_BOOKS = '''
+    CREATE TABLE IF NOT EXISTS books (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        author TEXT,
+        genre TEXT,
+        year INTEGER,
+        total_copies INTEGER DEFAULT 1,
+        available INTEGER DEFAULT 1,
+        added_on INTEGER
+    )
+'''
+SQL_CREATE_TRANSACTIONS = '''
+    CREATE TABLE IF NOT EXISTS transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        book_id INTEGER,
+        title TEXT,
+        action TEXT,
+        user TEXT,
+        timestamp INTEGER,
+        FOREIGN KEY(book_id) REFERENCES books(id)
+    )
+'''
+
+# Streamlit reruns the script on every interaction, so the connection is cached
+# once per process instead of being reopened on each query. Writes are guarded
+# by a lock because reruns may come from multiple script threads.
+_write_lock = threading.Lock()
+
+@st.cache_resource
+def get_conn():
+    return sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None,
+                           cached_statements=256)
+
+
+def _rebuild_with_epoch(c, table, create_sql, ts_col, other_cols):
+    """Rebuild a table whose timestamp column was declared TEXT by old schemas.
+
+    TEXT affinity would keep coercing epoch integers back to strings (so
+    ORDER BY and keyset comparisons misorder, and pd.to_datetime(unit='s')
+    raises), so recreate the table with the current DDL and convert values
+    on the way over: ISO strings through strftime, digit strings via CAST.
+    Runs only when the legacy declaration is detected.
+    """
+    decl = {r[1]: (r[2] or "").upper() for r in c.execute(f"PRAGMA table_info({table})")}
+    if decl.get(ts_col) != "TEXT":
+        return
+    c.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+    c.execute(create_sql)
+    conv = (f"CASE WHEN {ts_col} GLOB '*[^0-9]*' "
+            f"THEN CAST(strftime('%s', {ts_col}) AS INTEGER) "
+            f"ELSE CAST({ts_col} AS INTEGER) END")
+    c.execute(f"INSERT INTO {table} ({other_cols}, {ts_col}) "
+              f"SELECT {other_cols}, {conv} FROM {table}_old")
+    c.execute(f"DROP TABLE {table}_old")
+
+
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_conn()
     c = conn.cursor()
+    c.execute(SQL_CREATE_BOOKS)
+    c.execute(SQL_CREATE_TRANSACTIONS)
+    # migrate databases created before the title column was denormalized in
+    tx_cols = [r[1] for r in c.execute("PRAGMA table_info(transactions)").fetchall()]
+    if "title" not in tx_cols:
+        c.execute("ALTER TABLE transactions ADD COLUMN title TEXT")
+    # backfill titles for rows logged before the column existed (no-op
+    # afterwards; rows for since-deleted books stay NULL)
+    c.execute("UPDATE transactions SET title = (SELECT title FROM books WHERE books.id = transactions.book_id) WHERE title IS NULL")
+    # one-time rebuild for databases whose timestamp columns predate the
+    # epoch-integer switch; must run before the index/trigger DDL below so
+    # anything dropped with the old tables is recreated afterwards
+    _rebuild_with_epoch(c, "books", SQL_CREATE_BOOKS, "added_on",
+                        "id, title, author, genre, year, total_copies, available")
+    _rebuild_with_epoch(c, "transactions", SQL_CREATE_TRANSACTIONS, "timestamp",
+                        "id, book_id, title, action, user")
+    # drop the NOCASE indexes an earlier revision created for anchored LIKE
+    # lookups; no remaining query can use them (search goes through FTS or
+    # an unanchored LIKE) and they taxed every book insert/update
+    c.execute("DROP INDEX IF EXISTS idx_books_title_nocase")
+    c.execute("DROP INDEX IF EXISTS idx_books_author_nocase")
+    c.execute("DROP INDEX IF EXISTS idx_books_genre_nocase")
+    # partial index covering only in-stock rows; keeps the borrow path and
+    # any "available books" listing off a full table scan
+    c.execute("CREATE INDEX IF NOT EXISTS idx_books_avail ON books(available) WHERE available > 0")
+    # get_transactions orders by timestamp DESC with a LIMIT and joins on
+    # book_id; both need an index once the log grows.
+    c.execute("CREATE INDEX IF NOT EXISTS idx_tx_ts ON transactions(timestamp DESC)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_tx_book ON transactions(book_id)")
+    # Full-text index over the searchable columns, kept in sync by triggers.
+    # Contentless-mirror form: rows are stored once in books, only the
+    # inverted index lives in books_fts.
+    fts_exists = c.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'"
+    ).fetchone()
     c.execute('''
-        CREATE TABLE IF NOT EXISTS books (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            author TEXT,
-            genre TEXT,
-            year INTEGER,
-            total_copies INTEGER DEFAULT 1,
-            available INTEGER DEFAULT 1,
-            added_on TEXT
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+            title, author, genre,
+            content='books', content_rowid='id', tokenize='unicode61'
         )
     ''')
     c.execute('''
-        CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            book_id INTEGER,
-            action TEXT,
-            user TEXT,
-            timestamp TEXT,
-            FOREIGN KEY(book_id) REFERENCES books(id)
-        )
+        CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+            INSERT INTO books_fts(rowid, title, author, genre)
+            VALUES (new.id, new.title, new.author, new.genre);
+        END
     ''')
-    conn.commit()
-    conn.close()
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+            INSERT INTO books_fts(books_fts, rowid, title, author, genre)
+            VALUES ('delete', old.id, old.title, old.author, old.genre);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE ON books BEGIN
+            INSERT INTO books_fts(books_fts, rowid, title, author, genre)
+            VALUES ('delete', old.id, old.title, old.author, old.genre);
+            INSERT INTO books_fts(rowid, title, author, genre)
+            VALUES (new.id, new.title, new.author, new.genre);
+        END
+    ''')
+    if not fts_exists:
+        # backfill the index for databases created before books_fts existed
+        c.execute("INSERT INTO books_fts(books_fts) VALUES('rebuild')")
+    # WAL avoids the fsync-heavy rollback-journal cycle on every write; the
+    # rest are per-connection tunings, so they run on the cached handle.
+    c.execute("PRAGMA journal_mode=WAL")
+    c.execute("PRAGMA synchronous=NORMAL")
+    c.execute("PRAGMA temp_store=memory")
+    c.execute("PRAGMA cache_size=-64000")
+    c.execute("PRAGMA mmap_size=268435456")
+
+
+@st.cache_resource
+def _init_once():
+    # init_db is idempotent but still costs DDL round trips; run it exactly
+    # once per process rather than on every script rerun
+    init_db()
+    return True
+
+
+@contextmanager
+def _write_txn():
+    """Serialize writers behind the process lock and BEGIN IMMEDIATE.
+
+    Taking the database write lock up front avoids the SHARED-to-RESERVED
+    upgrade path that surfaces as SQLITE_BUSY under concurrent sessions.
+    """
+    conn = get_conn()
+    with _write_lock:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
 
 
 def run_query(query, params=(), fetch=False):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(query, params)
-    data = None
+    conn = get_conn()
     if fetch:
-        data = c.fetchall()
-    conn.commit()
-    conn.close()
-    return data
+        cur = conn.execute(query, params)
+        # named access for callers, without affecting pd.read_sql_query users
+        cur.row_factory = sqlite3.Row
+        return cur.fetchall()
+    with _write_txn() as conn:
+        conn.execute(query, params)
+    return None
+
+# Read helpers are cached with st.cache_data and keyed on a version counter
+# that every write bumps, so reruns that change nothing reuse the cached
+# DataFrames while any write invalidates them on the next read.
+
+def _books_ver():
+    return st.session_state.get('books_ver', 0)
+
+
+def _bump_books_ver():
+    st.session_state['books_ver'] = _books_ver() + 1
 
 # ---------------- CRUD operations ----------------
 
 def add_book(title, author, genre, year, copies):
-    now = datetime.now().isoformat()
-    run_query(
-        "INSERT INTO books (title, author, genre, year, total_copies, available, added_on) VALUES (?, ?, ?, ?, ?, ?, ?)",
-        (title, author, genre, year, copies, copies, now)
-    )
+    run_query(SQL_ADD_BOOK, (title, author, genre, year, copies, copies))
+    _bump_books_ver()
 
 
-def list_books():
-    rows = run_query("SELECT * FROM books ORDER BY id", fetch=True)
-    cols = ["id","title","author","genre","year","total_copies","available","added_on"]
-    return pd.DataFrame(rows, columns=cols) if rows else pd.DataFrame(columns=cols)
+def add_books_bulk(books):
+    """Insert many (title, author, genre, year, copies) rows in one transaction."""
+    rows = [(t, a, g, y, c, c) for t, a, g, y, c in books]
+    with _write_txn() as conn:
+        conn.executemany(SQL_ADD_BOOK, rows)
+    _bump_books_ver()
 
 
-def search_books(q):
-    q_like = f"%{q}%"
-    rows = run_query(
-        "SELECT * FROM books WHERE title LIKE ? OR author LIKE ? OR genre LIKE ? ORDER BY title",
-        (q_like, q_like, q_like),
-        fetch=True
-    )
-    cols = ["id","title","author","genre","year","total_copies","available","added_on"]
-    return pd.DataFrame(rows, columns=cols) if rows else pd.DataFrame(columns=cols)
+def _books_df(sql, params=()):
+    # timestamps are stored as epoch seconds; convert once for display
+    df = pd.read_sql_query(sql, get_conn(), params=params)
+    if not df.empty:
+        df['added_on'] = pd.to_datetime(df['added_on'], unit='s')
+    return df
+
+
+@st.cache_data
+def _list_books(ver, limit, offset):
+    return _books_df(SQL_LIST_BOOKS, (limit, offset))
+
+
+def list_books(limit=100, offset=0):
+    return _list_books(_books_ver(), limit, offset)
+
+
+def _fts_match(q):
+    # quote each token (doubling embedded quotes) so user input is never
+    # parsed as FTS syntax, and add * for prefix matching
+    tokens = (tok.replace('"', '""') for tok in q.split())
+    return " ".join(f'"{tok}"*' for tok in tokens)
+
+
+def search_books(q, contains=False):
+    if not q.strip():
+        return pd.read_sql_query("SELECT * FROM books LIMIT 0", get_conn())
+    if contains:
+        # substring scan for matches inside words, which FTS tokens miss;
+        # only taken when explicitly requested
+        q_like = f"%{q}%"
+        return _books_df(SQL_SEARCH_LIKE, (q_like, q_like, q_like))
+    return _books_df(SQL_SEARCH_FTS, (_fts_match(q),))
+
+
+def book_choices(q=""):
+    """Return (id, title, available) rows for the borrow/return dropdown."""
+    if q.strip():
+        return run_query(SQL_BOOK_CHOICES_FTS, (_fts_match(q),), fetch=True)
+    return run_query(SQL_BOOK_CHOICES, fetch=True)
+
+
+@st.cache_data
+def _stats(ver):
+    # st.cache_data pickles return values and sqlite3.Row is not picklable
+    row = run_query(SQL_STATS, fetch=True)
+    return tuple(row[0])
+
+
+def stats():
+    """Return (unique_titles, total_copies, available) aggregated in SQL."""
+    return _stats(_books_ver())
+
+
+@st.cache_data
+def _genre_counts(ver):
+    return pd.read_sql_query(SQL_GENRE_COUNTS, get_conn())
+
+
+def genre_counts():
+    return _genre_counts(_books_ver())
 
 
 def borrow_book(book_id, user_name):
-    # check availability
-    book = run_query("SELECT available FROM books WHERE id = ?", (book_id,), fetch=True)
-    if not book:
-        return False, "Book not found"
-    if book[0][0] <= 0:
-        return False, "No copies available"
-    run_query("UPDATE books SET available = available - 1 WHERE id = ?", (book_id,))
-    run_query("INSERT INTO transactions (book_id, action, user, timestamp) VALUES (?, 'borrow', ?, ?)",
-             (book_id, user_name, datetime.now().isoformat()))
-    return True, "Borrowed successfully"
+    # availability check folded into the UPDATE so check-and-decrement is atomic
+    with _write_txn() as conn:
+        rows = conn.execute(SQL_BORROW, (book_id,)).fetchall()
+        if not rows:
+            exists = conn.execute("SELECT 1 FROM books WHERE id = ?", (book_id,)).fetchone()
+            return False, "No copies available" if exists else "Book not found"
+        conn.execute(SQL_LOG_TX, (book_id, book_id, 'borrow', user_name))
+    _bump_books_ver()
+    return True, f"Borrowed successfully ({rows[0][0]} left)"
 
 
 def return_book(book_id, user_name):
-    # increase availability but not exceeding total_copies
-    row = run_query("SELECT available, total_copies FROM books WHERE id = ?", (book_id,), fetch=True)
-    if not row:
-        return False, "Book not found"
-    available, total = row[0]
-    if available >= total:
-        return False, "All copies already in library"
-    run_query("UPDATE books SET available = available + 1 WHERE id = ?", (book_id,))
-    run_query("INSERT INTO transactions (book_id, action, user, timestamp) VALUES (?, 'return', ?, ?)",
-             (book_id, user_name, datetime.now().isoformat()))
-    return True, "Returned successfully"
+    # increase availability but not exceeding total_copies, in one transaction
+    with _write_txn() as conn:
+        rows = conn.execute(SQL_RETURN, (book_id,)).fetchall()
+        if not rows:
+            exists = conn.execute("SELECT 1 FROM books WHERE id = ?", (book_id,)).fetchone()
+            return False, "All copies already in library" if exists else "Book not found"
+        conn.execute(SQL_LOG_TX, (book_id, book_id, 'return', user_name))
+    _bump_books_ver()
+    return True, f"Returned successfully ({rows[0][0]} available)"
+
+
+@st.cache_data
+def _get_transactions(ver, limit):
+    df = pd.read_sql_query(SQL_TRANSACTIONS, get_conn(), params=(limit,))
+    if not df.empty:
+        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
+    return df
 
 
 def get_transactions(limit=200):
-    rows = run_query("SELECT t.id, t.book_id, b.title, t.action, t.user, t.timestamp FROM transactions t LEFT JOIN books b ON t.book_id = b.id ORDER BY t.timestamp DESC LIMIT ?",
-                     (limit,), fetch=True)
-    cols = ["id","book_id","title","action","user","timestamp"]
-    return pd.DataFrame(rows, columns=cols) if rows else pd.DataFrame(columns=cols)
+    return _get_transactions(_books_ver(), limit)
+
+
+def get_transactions_page(before=None, limit=50):
+    """Fetch one keyset-paginated page of the transaction log.
+
+    Returns (df, cursor) where cursor is a raw (timestamp, id) pair to pass
+    as before for the next page, or None when the log is exhausted. The id
+    tie-break matters because timestamps have second resolution, so rows
+    sharing the boundary timestamp would otherwise be skipped. The keyset
+    WHERE stays an O(limit) scan of idx_tx_ts no matter how large the table
+    grows, unlike OFFSET.
+    """
+    if before is None:
+        df = pd.read_sql_query(SQL_TRANSACTIONS, get_conn(), params=(limit,))
+    else:
+        ts, last_id = before
+        df = pd.read_sql_query(SQL_TRANSACTIONS_PAGE, get_conn(), params=(ts, ts, last_id, limit))
+    cursor = (int(df['timestamp'].iloc[-1]), int(df['id'].iloc[-1])) if len(df) == limit else None
+    if not df.empty:
+        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
+    return df, cursor
 
 # ---------------- Sample data loader ----------------
 
@@ -117,39 +355,39 @@ def load_sample_data():
         ("To Kill a Mockingbird", "Harper Lee", "Fiction", 1960, 2),
         ("Deep Work", "Cal Newport", "Productivity", 2016, 1),
     ]
-    for t,a,g,y,c in sample_books:
-        add_book(t,a,g,y,c)
+    add_books_bulk(sample_books)
 
 # ---------------- Streamlit UI ----------------
 
 st.set_page_config(page_title="Library Management — Streamlit", layout="wide")
-init_db()
+_init_once()
 
 st.title("📚 Library Management System (Streamlit)")
 
 menu = st.sidebar.selectbox("Go to", ["Dashboard", "Manage Books", "Borrow/Return", "Transactions", "Load Sample Data", "About"])
 
+PAGE_SIZE = 100
+
 if menu == "Dashboard":
     st.header("Library Dashboard")
-    df = list_books()
     col1, col2 = st.columns([2,1])
     with col1:
         st.subheader("Book Catalog")
+        page = st.number_input("Page", min_value=1, value=1, step=1)
+        df = list_books(limit=PAGE_SIZE, offset=(int(page) - 1) * PAGE_SIZE)
         st.dataframe(df)
 
     with col2:
         st.subheader("Quick Stats")
-        total_books = df['total_copies'].sum() if not df.empty else 0
-        unique_titles = len(df) if not df.empty else 0
-        available = df['available'].sum() if not df.empty else 0
+        unique_titles, total_books, available = stats()
         st.metric("Total copies", total_books)
         st.metric("Unique titles", unique_titles)
         st.metric("Available copies", available)
 
         st.subheader("Most common genres")
-        if not df.empty:
-            genre_counts = df.groupby('genre')['total_copies'].sum().reset_index()
-            chart = alt.Chart(genre_counts).mark_bar().encode(x='genre', y='total_copies')
+        genres = genre_counts()
+        if not genres.empty:
+            chart = alt.Chart(genres).mark_bar().encode(x='genre', y='total_copies')
             st.altair_chart(chart, use_container_width=True)
         else:
             st.write("No books yet")
@@ -177,20 +415,24 @@ elif menu == "Manage Books":
     st.markdown("---")
     st.header("Search / Edit books")
     q = st.text_input("Search by title/author/genre")
+    contains = st.checkbox("Match inside words (slower)")
     if q:
-        res = search_books(q)
+        res = search_books(q, contains=contains)
         st.dataframe(res)
     else:
         st.write("Type in the search box to filter books")
 
 elif menu == "Borrow/Return":
     st.header("Borrow or Return a Book")
-    df = list_books()
-    if df.empty:
+    filter_q = st.text_input("Filter books (title/author/genre)")
+    choices = book_choices(filter_q)
+    if not choices:
         st.info("No books available. Add some in Manage Books.")
     else:
-        book_choice = st.selectbox("Choose book (id - title)", df.apply(lambda r: f"{r['id']} - {r['title']} ({r['available']} available)", axis=1).tolist())
-        book_id = int(book_choice.split(" - ")[0])
+        labels = [f"{r['id']} - {r['title']} ({r['available']} available)" for r in choices]
+        label_to_id = dict(zip(labels, (r['id'] for r in choices)))
+        book_choice = st.selectbox("Choose book (id - title)", labels)
+        book_id = label_to_id[book_choice]
         user_name = st.text_input("Your name")
         col1, col2 = st.columns(2)
         with col1:
@@ -216,8 +458,20 @@ elif menu == "Borrow/Return":
 
 elif menu == "Transactions":
     st.header("Transactions")
-    tx = get_transactions(500)
+    # restart from the first page whenever a write bumped the version,
+    # so borrows/returns made this session show up here
+    if 'tx_pages' not in st.session_state or st.session_state.get('tx_pages_ver') != _books_ver():
+        df, cursor = get_transactions_page()
+        st.session_state['tx_pages'] = [df]
+        st.session_state['tx_cursor'] = cursor
+        st.session_state['tx_pages_ver'] = _books_ver()
+    tx = pd.concat(st.session_state['tx_pages'], ignore_index=True)
     st.dataframe(tx)
+    if st.session_state['tx_cursor'] is not None and st.button("Load more"):
+        df, cursor = get_transactions_page(st.session_state['tx_cursor'])
+        st.session_state['tx_pages'].append(df)
+        st.session_state['tx_cursor'] = cursor
+        st.rerun()
 
 elif menu == "Load Sample Data":
     st.warning("This will add sample books to the DB. Do not click if you already have production data")